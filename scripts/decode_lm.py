@@ -15,7 +15,7 @@ def decode(model, start_tokens=None, max_len=1000, device="cpu", mode="top_p"):
     for _ in range(max_len):
         tgt_tensor = torch.tensor([tgt_tokens]).to(device)
         with torch.no_grad():
-            output = model(tgt_tensor)
+            output = model(tgt_tensor, is_causal=True, last_token_only=True)
 
         next_token_logits = output[0, -1, :]
 
@@ -83,6 +83,8 @@ def main():
         max_length=max_length,
         value_length=value_length,
         dropout=dropout,
+        # must match train_lm.py
+        tie_weights=True,
     ).to(device)
 
     # Load the trained model weights
@@ -30,7 +30,7 @@ def decode(model, src_sentence, max_len=100, device="cpu"):
     for _ in range(max_len):
         tgt_tensor = torch.tensor([tgt_tokens]).to(device)
         with torch.no_grad():
-            output = model(tgt_tensor)
+            output = model(tgt_tensor, is_causal=True, last_token_only=True)
 
         next_token_logits = output[0, -1, :]
         next_token = torch.argmax(next_token_logits, dim=-1)
@@ -57,22 +57,6 @@ def save_checkpoint(epoch: int, model, optimizer, scheduler, latest=True):
         torch.save(checkpoint, f"screenplay_lm_gpt_{epoch}.pt")
 
 
-def make_pad_mask(q, k):
-    # k: (B, T_k)
-    # returns: (B, 1, 1, T_k)
-    pad_mask = k.eq(tokenizer.pad_token_id).unsqueeze(1).unsqueeze(1)
-    return pad_mask
-
-
-def make_no_peak_mask(q, k, device=1):
-    # Create a look-ahead mask to prevent attending to future tokens
-    len_q, len_k = q.size(1), k.size(1)
-    mask = torch.triu(
-        torch.ones(len_q, len_k, device=device, dtype=torch.bool), diagonal=1
-    )
-    return mask
-
-
 def train_lm():
     data_path = Path("data/lm/")
     dataset = ScreenplayDataset(data_path)
@@ -80,6 +64,9 @@ def train_lm():
 
     device = 1
 
+    # allow TF32 tensor cores for any matmuls that stay in fp32
+    torch.set_float32_matmul_precision("high")
+
     vocab_size = len(tokenizer.vocab)
     num_layers = 6
     num_heads = 8
@@ -112,6 +99,10 @@ def train_lm():
         max_length=max_length,
         value_length=value_length,
         dropout=dropout,
+        # the GPT-2 vocab (~50k) makes the output projection the largest
+        # matrix in the model; sharing it with the embedding saves V * C
+        # parameters and their optimizer state
+        tie_weights=True,
     ).to(device)
 
     # Loss shouldn't include pad tokens, so ignore them in the loss calculation
@@ -119,6 +110,16 @@ def train_lm():
     optimizer = optim.AdamW(model.parameters(), lr=base_lr, betas=[0.9, 0.98], eps=1e-9)
     scheduler = LambdaLR(optimizer, lr_lambda=lr_lambda)
 
+    # Compile the training forward to fuse pointwise ops across layers and cut
+    # per-layer Python/dispatch overhead. Batches here have variable lengths,
+    # and CUDA graphs ("reduce-overhead") would record a separate graph for
+    # every distinct shape even with dynamic=True, so we skip them.
+    # We keep `model` around uncompiled so checkpoints keep their plain
+    # state_dict keys (no `_orig_mod.` prefix) and load into the decode scripts.
+    compiled_model = torch.compile(
+        model, mode="max-autotune-no-cudagraphs", fullgraph=False, dynamic=True
+    )
+
     # train over all epochs, checkpointing every 25 epochs
     for epoch in range(epochs):
         model.train()
@@ -133,16 +134,19 @@ def train_lm():
 
                 optimizer.zero_grad()
 
-                trg_pad_mask = make_pad_mask(para_input, para_input)
-                trg_no_peak_mask = make_no_peak_mask(para_input, para_input)
-
-                trg_mask = trg_pad_mask | trg_no_peak_mask
+                # Paragraphs are right-padded, so under a causal mask real tokens
+                # never see padding, and pad positions are ignored by the loss.
+                # That means we only need is_causal=True and no explicit mask,
+                # which keeps attention on the fused kernels' mask-free path.
 
-                output = model(para_input, tgt_mask=trg_mask)
+                # bf16 autocast halves activation traffic and lets SDPA use
+                # the FlashAttention kernels, which need fp16/bf16 inputs
+                with torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                    output = compiled_model(para_input, is_causal=True)
 
-                loss = criterion(
-                    output.reshape(-1, vocab_size), para_output.reshape(-1)
-                )
+                    loss = criterion(
+                        output.reshape(-1, vocab_size), para_output.reshape(-1)
+                    )
                 loss.backward()
                 optimizer.step()
                 scheduler.step()
@@ -25,14 +25,31 @@ run = wandb.init(
 
 def decode(model, src_sentence, max_len=100, device=1):
     model.eval()
-    src_tensor = tokenizer.encode(src_sentence).to(device)
+    src_tensor = tokenizer.encode(src_sentence).to(device).unsqueeze(0)
+
+    # the source side doesn't change between steps, so encode it and project
+    # the cross-attention keys/values once up front
+    src_mask = model.make_pad_mask(src_tensor, src_tensor)
+    with torch.no_grad():
+        enc_src = model.encoder(src_tensor, src_mask)
+        cross_kv = model.decoder.precompute_cross_kv(enc_src)
 
     tgt_tokens = [tokenizer.bos_token_id]
 
     for _ in tqdm(range(max_len)):
         tgt_tensor = torch.tensor([tgt_tokens]).to(device)
         with torch.no_grad():
-            output = model(src_tensor.unsqueeze(0), tgt_tensor)
+            # the generated prefix has no padding, so causality is the only
+            # target-side mask we need
+            output = model.decoder(
+                tgt_tensor,
+                enc_src,
+                None,
+                src_mask,
+                cross_kv=cross_kv,
+                is_causal=True,
+                last_token_only=True,
+            )
 
         next_token_logits = output[0, -1, :]
         next_token_probs = torch.softmax(next_token_logits, dim=-1)
@@ -64,6 +81,9 @@ def train_nmt():
 
     device = 1
 
+    # allow TF32 tensor cores for any matmuls that stay in fp32
+    torch.set_float32_matmul_precision("high")
+
     vocab_size = len(tokenizer.vocab)
     num_layers = 6
     num_heads = 8
@@ -105,6 +125,16 @@ def train_nmt():
     optimizer = optim.AdamW(model.parameters(), lr=base_lr, betas=[0.9, 0.98], eps=1e-9)
     scheduler = LambdaLR(optimizer, lr_lambda=lr_lambda)
 
+    # Compile the training forward to fuse pointwise ops across layers and cut
+    # per-layer Python/dispatch overhead. Batches here have variable lengths,
+    # and CUDA graphs ("reduce-overhead") would record a separate graph for
+    # every distinct shape even with dynamic=True, so we skip them.
+    # We keep `model` around uncompiled so checkpoints keep their plain
+    # state_dict keys (no `_orig_mod.` prefix) and load into the decode scripts.
+    compiled_model = torch.compile(
+        model, mode="max-autotune-no-cudagraphs", fullgraph=False, dynamic=True
+    )
+
     # train over all epochs, checkpointing every 25 epochs
     for epoch in range(epochs):
         model.train()
@@ -122,9 +152,12 @@ def train_nmt():
 
                 optimizer.zero_grad()
 
-                output = model(src, tgt_input)
+                # bf16 autocast halves activation traffic and lets SDPA use
+                # the FlashAttention kernels, which need fp16/bf16 inputs
+                with torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                    output = compiled_model(src, tgt_input)
 
-                loss = criterion(output.reshape(-1, vocab_size), tgt_output.reshape(-1))
+                    loss = criterion(output.reshape(-1, vocab_size), tgt_output.reshape(-1))
                 loss.backward()
                 optimizer.step()
                 scheduler.step()
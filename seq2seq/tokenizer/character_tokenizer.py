@@ -1,13 +1,19 @@
 from .tokenizer import Tokenizer
 
+import logging
+
+import numpy as np
 import torch
 
 
+logger = logging.getLogger(__name__)
+
+
 class CharacterTokenizer(Tokenizer):
     def __init__(self, verbose: bool = True):
         """
         Initializes the CharacterTokenizer class for French to English translation.
-        If verbose is True, prints out the vocabulary.
+        If verbose is True, logs the vocabulary at DEBUG level.
 
         We ignore capitalization.
 
@@ -24,39 +30,85 @@ class CharacterTokenizer(Tokenizer):
         self.characters = """aàâæbcçdeéèêëfghiîïjklmnoôœpqrstuùûüvwxyÿz0123456789,;.!?:'\"/\\|_@#$%^&*~`+-=<>()[]{}’•–í€óá«»… º◦©ö°äµ—ø­·òãñ―½¼γ®⇒²▪−√¥£¤ß´úª¾є™，ﬁõ  �►□′″¨³‑¯≈ˆ§‰●ﬂ⇑➘①②„≤±†✜✔➪✖◗¢ไทยếệεληνικαåşıруский 한국어汉语ž¹¿šćþ‚‛─÷〈¸⎯×←→∑δ■ʹ‐≥τ;∆℡ƒð¬¡¦βϕ▼⁄ρσ⋅≡∂≠π⎛⎜⎞ω∗"""
         for idx, char in enumerate(self.characters):
             self.vocab[char] = idx
+
+        # codepoint -> token id lookup table so encode is a single numpy gather.
+        # The extra trailing -1 entry catches every codepoint past the last
+        # vocab character (see the mode="clip" in encode). The table spans the
+        # whole BMP, so store ids in the smallest signed dtype that fits the
+        # vocab (int16 here, ~128KB) to keep it small and cache-friendly.
+        lut_dtype = np.min_scalar_type(-len(self.characters))
+        self._lut = np.full(max(map(ord, self.vocab)) + 2, -1, dtype=lut_dtype)
+        for char, idx in self.vocab.items():
+            self._lut[ord(char)] = idx
+
+        # token id -> character, for decode (ids are just indices into characters)
+        self._id_to_char = list(self.characters)
     
-        if verbose:
-            print("Vocabulary:", self.vocab)
+        # only stringify the vocab if someone is actually listening
+        if verbose and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Vocabulary: %s", self.vocab)
 
         #raise NotImplementedError("Need to implement vocab initialization")
 
+    def _lookup(self, text: str) -> np.ndarray:
+        """
+        Map text to a numpy array of token ids.
+
+        Raises:
+            ValueError: if the text contains characters outside the vocab
+        """
+        cps = np.frombuffer(text.lower().encode("utf-32-le"), dtype=np.uint32)
+        ids = self._lut.take(cps, mode="clip")
+
+        missing = np.flatnonzero(ids < 0)
+        if missing.size:
+            raise ValueError(
+                f"{missing.size} OOV chars at positions {missing[:10].tolist()}"
+            )
+
+        return ids
+
     def encode(self, text: str) -> torch.Tensor:
+        return torch.from_numpy(self._lookup(text).astype(np.int64))
 
-        tokens = []
+    def encode_batch(
+        self, texts: list[str], *, pad_id: int
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Encode a batch of strings into a single right-padded tensor.
+
+        Args:
+            texts: list of B strings
+            pad_id: token id used to fill positions past the end of each string.
+                Required, since this tokenizer has no pad token of its own and
+                every id in the vocab is a real character.
+
+        Returns:
+            Tuple of (ids, lengths), where ids is a torch.int64 tensor of shape
+            (B, max_length) and lengths is a torch.int64 tensor of shape (B,)
+        """
+        arrs = [self._lookup(text) for text in texts]
+        lengths = np.array([a.size for a in arrs], dtype=np.int64)
 
-        for char in text.lower(): 
-            if char in self.vocab:
-                tokens.append(self.vocab[char])
-            else:
-                print("damn bro did not make sure the chars are in vocab")
+        out = np.full((len(texts), lengths.max(initial=0)), pad_id, dtype=np.int64)
+        for i, a in enumerate(arrs):
+            out[i, : a.size] = a
 
-        return torch.tensor(tokens)
+        return torch.from_numpy(out), torch.from_numpy(lengths)
     
         # raise NotImplementedError(
         #     "Need to implement encoder that converts text to tensor of tokens."
         # )
 
     def decode(self, tokens: torch.Tensor) -> str:
-        reverse = {v: k for k, v in self.vocab.items()}
-        decoded = []
+        # a single .tolist() does one device -> host copy instead of a sync
+        # per token, and gives plain ints to index the python list with
+        ids = tokens.tolist()
 
-        for token in tokens:
-            if token.item() in reverse:
-                decoded.append(reverse[token.item()])
-            else:
-                print("damn bro did not make sure the tokens are in vocab")
+        if ids and (min(ids) < 0 or max(ids) >= len(self._id_to_char)):
+            raise ValueError("Token ids out of range for the vocab")
 
-        return "".join(decoded)
+        return "".join([self._id_to_char[t] for t in ids])
 
         # raise NotImplementedError(
         #     "Need to implement decoder that converts tensor of tokens to text."
@@ -1,4 +1,4 @@
 from .encoder import Encoder, EncoderLayer, PositionalEncoding
-from .decoder import Decoder, DecoderLayer
+from .decoder import Decoder, DecoderLayer, CUDAGraphDecoder
 from .attention import MultiHeadAttention, FeedForwardNN
 from .transformer import Transformer
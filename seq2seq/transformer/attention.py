@@ -1,12 +1,74 @@
+from functools import lru_cache
 from typing import Optional
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.attention.flex_attention import BlockMask, create_block_mask, flex_attention
+
+
+# compiled once at import; compilation itself happens lazily on the first call.
+# With dynamic=False every new sequence length (and so every new per-T block
+# mask from sliding_window_block_mask) triggers a recompile. Once dynamo's
+# recompile limit (torch._dynamo.config.cache_size_limit) is hit, it gives up
+# and runs flex_attention eagerly, which is much slower, so keep the set of
+# sequence lengths small (e.g. by bucketing) when using sliding windows.
+compiled_flex_attention = torch.compile(flex_attention, dynamic=False)
+
+
+def sliding_window_mask_mod(window_size: int):
+    """
+    FlexAttention mask_mod for causal sliding-window attention: each query
+    attends to itself and the window_size - 1 keys right before it.
+    """
+
+    def mask_mod(b, h, q_idx, kv_idx):
+        return (q_idx >= kv_idx) & (q_idx - kv_idx < window_size)
+
+    return mask_mod
+
+
+@lru_cache(maxsize=32)
+def sliding_window_block_mask(
+    window_size: int, seq_len: int, device: torch.device
+) -> BlockMask:
+    """
+    Build (and cache per sequence length) the block-sparse mask used by
+    FlexAttention for causal sliding-window attention. Blocks that fall
+    entirely outside the window are skipped, so cost grows ~linearly in T.
+    Each distinct seq_len also means a recompile of compiled_flex_attention.
+    """
+    return create_block_mask(
+        sliding_window_mask_mod(window_size),
+        B=None,
+        H=None,
+        Q_LEN=seq_len,
+        KV_LEN=seq_len,
+        device=device,
+    )
+
+
+def sliding_window_dense_mask(
+    window_size: int, seq_len: int, device: torch.device
+) -> torch.Tensor:
+    """
+    Dense (T, T) boolean version of the causal sliding-window mask, True
+    where attention is allowed. Used when the window has to be combined
+    with an explicit (e.g. padding) mask.
+    """
+    idx = torch.arange(seq_len, device=device)
+    dist = idx[:, None] - idx[None, :]
+    return (dist >= 0) & (dist < window_size)
 
 
 class MultiHeadAttention(nn.Module):
     def __init__(
-        self, num_heads: int, embedding_dim: int, qk_length: int, value_length: int
+        self,
+        num_heads: int,
+        embedding_dim: int,
+        qk_length: int,
+        value_length: int,
+        num_kv_heads: Optional[int] = None,
     ):
         """
         The Multi-Head Attention layer will take in Q, K, and V
@@ -24,19 +86,36 @@ class MultiHeadAttention(nn.Module):
         Finally, you will concatenate the heads and project the
         output to have a shape of (B, T, C).
 
-        Check out the `masked_fill` method in PyTorch to help
-        you implement the masking step!
+        Masking is handled by F.scaled_dot_product_attention. Masks are
+        boolean and True where attention is ALLOWED (e.g. non-pad keys, or
+        keys at or before the query for a causal mask), matching SDPA's
+        attn_mask convention.
+
+        If num_kv_heads is set (and divides num_heads), K and V only get
+        num_kv_heads heads, each shared by a group of query heads
+        (grouped-query attention; num_kv_heads=1 is multi-query attention).
+        This shrinks the K/V projections and any cached K/V by
+        num_heads / num_kv_heads.
         """
         super().__init__()
 
         self.num_heads = num_heads
+        self.num_kv_heads = num_kv_heads if num_kv_heads is not None else num_heads
+        assert num_heads % self.num_kv_heads == 0, (
+            "num_heads must be a multiple of num_kv_heads"
+        )
         self.qk_length = qk_length
         self.value_length = value_length
         self.embedding_dim = embedding_dim #need embedding dim to project from
 
-        self.Q = nn.Linear(embedding_dim, num_heads * qk_length)
-        self.K = nn.Linear(embedding_dim, num_heads * qk_length)
-        self.V = nn.Linear(embedding_dim, num_heads * value_length)
+        # Q, K and V projections are stacked into one linear layer so that
+        # self-attention does a single GEMM instead of three. Rows are laid out
+        # as [Q | K | V]; nn.Linear initializes from fan_in (= embedding_dim),
+        # so each slice gets the same init as a standalone projection would.
+        self.in_proj = nn.Linear(
+            embedding_dim,
+            num_heads * qk_length + self.num_kv_heads * (qk_length + value_length),
+        )
 
         # last linear layer after concat
         # name it output_projection to match usage in forward
@@ -45,28 +124,36 @@ class MultiHeadAttention(nn.Module):
 
         #raise NotImplementedError("Need to implement MHA layers")
 
-    def split_heads(self, x: torch.Tensor, vec_length: int) -> torch.Tensor:
+    def split_heads(
+        self, x: torch.Tensor, vec_length: int, num_heads: Optional[int] = None
+    ) -> torch.Tensor:
         """
         Split the C dimension of the input tensor into num_heads
         different heads, each with shape (B, T, vec_length).
-        Hint: check out the `view` and 'permute` methods in PyTorch to help
-        you reshape the tensor.
+        Hint: check out the `reshape` and `transpose` methods in PyTorch to
+        help you reshape the tensor.
 
         Args:
             x: torch.Tensor of shape (B, T, C), where C = num_heads * vec_length
             vec_length: int, the length of the query/key/value vectors
+            num_heads: Optional number of heads to split into, defaults to
+                self.num_heads (K and V use self.num_kv_heads)
 
         Returns:
             torch.Tensor of shape (B, num_heads, T, vec_length)
         """
-        B, T, C = x.size()
+        if num_heads is None:
+            num_heads = self.num_heads
 
-        assert C // self.num_heads == vec_length, (
+        # plain assert, so it's stripped entirely under `python -O`
+        assert x.shape[-1] == num_heads * vec_length, (
             "Input tensor does not have the correct shape for splitting."
         )
 
-        x = x.view(B, T, self.num_heads, vec_length)
-        x = x.permute(0, 2, 1, 3).contiguous()  # (B, num_heads, T, vec_length)
+        # no .contiguous() here: the strided view feeds straight into the
+        # attention kernel, which handles non-contiguous inputs without a copy.
+        # unflatten avoids unpacking B and T just to rebuild the shape.
+        x = x.unflatten(-1, (num_heads, vec_length)).transpose(1, 2)  # (B, num_heads, T, vec_length)
 
 
         return x
@@ -76,8 +163,8 @@ class MultiHeadAttention(nn.Module):
     def combine_heads(self, x: torch.Tensor) -> torch.Tensor:
         """
         Combine the num_heads different heads into a single tensor.
-        Hint: check out the `contiguous` method in PyTorch to help
-        you reshape the tensor.
+        Hint: check out the `transpose` and `reshape` methods in PyTorch to
+        help you reshape the tensor.
 
         Args:
             x: torch.Tensor of shape (B, num_heads, T, vec_length)
@@ -85,10 +172,8 @@ class MultiHeadAttention(nn.Module):
         Returns:
             torch.Tensor of shape (B, T, num_heads * vec_length)
         """
-        B, num_heads, T, vec_length = x.size()
-
-        x = x.permute(0, 2, 1, 3).contiguous()  
-        x = x.view(B, T, num_heads * vec_length)
+        # flatten only copies when the transposed layout requires it
+        x = x.transpose(1, 2).flatten(2)
 
 
         return x
@@ -100,6 +185,8 @@ class MultiHeadAttention(nn.Module):
         K: torch.Tensor,
         V: torch.Tensor,
         mask: Optional[torch.Tensor] = None,
+        is_causal: bool = False,
+        block_mask: Optional[BlockMask] = None,
     ) -> torch.Tensor:
         """
         Compute the scaled dot-product attention given Q, K, and V.
@@ -110,28 +197,95 @@ class MultiHeadAttention(nn.Module):
             K: torch.Tensor of shape (B, num_heads, T, qk_length)
             V: torch.Tensor of shape (B, num_heads, T, value_length)
             mask: Optional boolean torch.Tensor, broadcastable to (B, num_heads, T, T).
+                True marks positions that may be attended to. This is the
+                convention F.scaled_dot_product_attention uses, so masks built
+                once per batch are passed through without any per-call work.
+            is_causal: If True, also prevent each query from attending to later
+                keys, without us having to build a (T, T) causal mask.
+            block_mask: Optional FlexAttention BlockMask (e.g. from
+                `sliding_window_block_mask`). If given, attention runs through
+                FlexAttention and skips fully-masked blocks; mask and is_causal
+                must then already be encoded in the block mask.
         """
-        #transpose with -2, -1 to swap last two dims
-        #so that K goes from (B, num_heads, T, qk_length) to (B, num_heads, qk_length, T)
-        scores = torch.matmul(Q, K.transpose(-2, -1)) / (self.qk_length ** 0.5)  # this will give (B, num_heads, T, T)
+        # with grouped-query attention K/V have fewer heads than Q; the kernels
+        # broadcast each K/V head over its query group without copying
+        enable_gqa = K.shape[1] != Q.shape[1]
+
+        if block_mask is not None:
+            assert mask is None, "Cannot combine a block_mask with a dense mask"
+            return compiled_flex_attention(
+                Q, K, V, block_mask=block_mask, enable_gqa=enable_gqa
+            )
+
+        # F.scaled_dot_product_attention fuses QK^T, scaling, masking and softmax
+        # into one kernel (FlashAttention / mem-efficient attention), so the
+        # (B, num_heads, T, T) score matrix is never materialized in HBM.
+        # It also applies the 1 / sqrt(qk_length) scaling itself.
+        if mask is None:
+            # no explicit mask at all lets the fused kernels apply causality
+            # on the fly and skip fully-masked blocks
+            return F.scaled_dot_product_attention(
+                Q, K, V, is_causal=is_causal, enable_gqa=enable_gqa
+            )
+
+        assert mask.dtype == torch.bool, "Mask must be boolean"
+        assert mask.shape[-1] == K.shape[-2], "Mask shape mismatch"
+
+        if is_causal:
+            # SDPA won't take is_causal together with attn_mask, so fold the
+            # causal part into the (pad) mask we were given. Decoder already
+            # does this once per forward, so this only runs on direct calls.
+            causal_mask = torch.ones(
+                Q.shape[-2], K.shape[-2], dtype=torch.bool, device=Q.device
+            ).tril()
+            mask = mask & causal_mask
+
+        out = F.scaled_dot_product_attention(
+            Q, K, V, attn_mask=mask, enable_gqa=enable_gqa
+        )  # (B, num_heads, T, value_length)
 
-            
-        if mask is not None:
-            assert mask.dtype == torch.bool, "Mask must be boolean"
-            #print(mask.shape, scores.shape)
-            # Mask is [B,1,1,T], we need to expand dims to [B,1,T,T] in encode and decode
-            assert mask.shape[-2] == scores.shape[-2] and mask.shape[-1] == scores.shape[-1], "Mask shape mismatch"
+        return out
 
-            scores = scores.masked_fill(mask, float('-inf'))
+        #raise NotImplementedError("Need to implement scaled_dot_product_attention")
 
-        attention_weights = torch.softmax(scores, dim=-1)  # (B, num_heads, T, T)
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints from before the fused projection store separate Q, K and
+        # V layers; stack them into in_proj's [Q | K | V] layout so they still
+        # load with strict=True
+        for name in ("weight", "bias"):
+            legacy_keys = [f"{prefix}{proj}.{name}" for proj in ("Q", "K", "V")]
+            if all(key in state_dict for key in legacy_keys):
+                state_dict[f"{prefix}in_proj.{name}"] = torch.cat(
+                    [state_dict.pop(key) for key in legacy_keys], dim=0
+                )
 
-        #this is our activation table looking thing
-        out = torch.matmul(attention_weights, V)  # (B, num_heads, T, value_length)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
-        return out
+    def precompute_kv(self, x: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Project x into keys and values and split them into heads. Used for
+        cross-attention, where K and V both come from the encoder output and
+        can be reused across decoding steps.
 
-        #raise NotImplementedError("Need to implement scaled_dot_product_attention")
+        Args:
+            x: torch.Tensor of shape (B, T, C)
+
+        Returns:
+            Tuple of (K_split, V_split), of shapes (B, num_kv_heads, T, qk_length)
+            and (B, num_kv_heads, T, value_length)
+        """
+        q_dim = self.num_heads * self.qk_length
+        k_dim = self.num_kv_heads * self.qk_length
+        v_dim = self.num_kv_heads * self.value_length
+
+        K, V = F.linear(
+            x, self.in_proj.weight[q_dim:], self.in_proj.bias[q_dim:]
+        ).split([k_dim, v_dim], dim=-1)
+
+        return (
+            self.split_heads(K, self.qk_length, self.num_kv_heads),
+            self.split_heads(V, self.value_length, self.num_kv_heads),
+        )
 
     def forward(
         self,
@@ -139,6 +293,9 @@ class MultiHeadAttention(nn.Module):
         K: torch.Tensor,
         V: torch.Tensor,
         mask: Optional[torch.Tensor] = None,
+        precomputed_kv: Optional[tuple[torch.Tensor, torch.Tensor]] = None,
+        is_causal: bool = False,
+        block_mask: Optional[BlockMask] = None,
     ) -> torch.Tensor:
         """
         The forward pass of the Multi-Head Attention layer.
@@ -147,21 +304,50 @@ class MultiHeadAttention(nn.Module):
             Q: torch.Tensor of shape (B, T, C)
             K: torch.Tensor of shape (B, T, C)
             V: torch.Tensor of shape (B, T, C)
-            mask: Optional torch.Tensor of shape (B, T, T) or None
+            mask: Optional boolean torch.Tensor broadcastable to
+                (B, num_heads, T_q, T_k), e.g. (B, 1, 1, T_k) for padding, or
+                None. True marks positions that may be attended to.
+            precomputed_kv: Optional (K_split, V_split) from `precompute_kv`.
+                If given, K and V are ignored and not projected again.
+            is_causal: If True, apply a causal mask on top of `mask`.
+            block_mask: Optional FlexAttention BlockMask, used instead of
+                `mask` / `is_causal` (see `scaled_dot_product_attention`).
 
         Returns:
             torch.Tensor of shape (B, T, C)
         """
-
-        Q = self.Q(Q)
-        K = self.K(K)
-        V = self.V(V)
-
-        Q_split = self.split_heads(Q, self.qk_length)
-        K_split = self.split_heads(K, self.qk_length)
-        V_split = self.split_heads(V, self.value_length)
-
-        attn = self.scaled_dot_product_attention(Q_split, K_split, V_split, mask)
+        q_dim = self.num_heads * self.qk_length
+        k_dim = self.num_kv_heads * self.qk_length
+        v_dim = self.num_kv_heads * self.value_length
+        weight, bias = self.in_proj.weight, self.in_proj.bias
+
+        if precomputed_kv is not None:
+            Q = F.linear(Q, weight[:q_dim], bias[:q_dim])
+            Q_split = self.split_heads(Q, self.qk_length)
+            K_split, V_split = precomputed_kv
+        elif Q is K and K is V:
+            # self-attention: one fused GEMM for all three projections
+            Q, K, V = self.in_proj(Q).split([q_dim, k_dim, v_dim], dim=-1)
+            Q_split = self.split_heads(Q, self.qk_length)
+            K_split = self.split_heads(K, self.qk_length, self.num_kv_heads)
+            V_split = self.split_heads(V, self.value_length, self.num_kv_heads)
+        elif K is V:
+            # cross-attention: K and V both come from the encoder output
+            Q = F.linear(Q, weight[:q_dim], bias[:q_dim])
+            Q_split = self.split_heads(Q, self.qk_length)
+            K_split, V_split = self.precompute_kv(K)
+        else:
+            Q = F.linear(Q, weight[:q_dim], bias[:q_dim])
+            kv_start = q_dim + k_dim
+            K = F.linear(K, weight[q_dim:kv_start], bias[q_dim:kv_start])
+            V = F.linear(V, weight[kv_start:], bias[kv_start:])
+            Q_split = self.split_heads(Q, self.qk_length)
+            K_split = self.split_heads(K, self.qk_length, self.num_kv_heads)
+            V_split = self.split_heads(V, self.value_length, self.num_kv_heads)
+
+        attn = self.scaled_dot_product_attention(
+            Q_split, K_split, V_split, mask, is_causal=is_causal, block_mask=block_mask
+        )
 
         combined = self.combine_heads(attn)
         out = self.output_projection(combined)
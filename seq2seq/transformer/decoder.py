@@ -2,7 +2,14 @@ import torch
 import torch.nn as nn
 from typing import Optional
 
-from .attention import MultiHeadAttention, FeedForwardNN
+from torch.nn.attention.flex_attention import BlockMask
+
+from .attention import (
+    MultiHeadAttention,
+    FeedForwardNN,
+    sliding_window_block_mask,
+    sliding_window_dense_mask,
+)
 from .encoder import PositionalEncoding
 from seq2seq.data.fr_en import tokenizer
 
@@ -16,6 +23,7 @@ class DecoderLayer(nn.Module):
         qk_length: int,
         value_length: int,
         dropout: float = 0.1,
+        num_kv_heads: int | None = None,
     ):
         """
         Each decoder layer will take in two embeddings of
@@ -36,6 +44,9 @@ class DecoderLayer(nn.Module):
 
         Remember that for each Multi-Head Attention layer, we
         need create Q, K, and V matrices from the input embedding(s)!
+
+        num_kv_heads enables grouped-query attention in both attention
+        layers (see MultiHeadAttention).
         """
         super().__init__()
 
@@ -48,9 +59,13 @@ class DecoderLayer(nn.Module):
         # Define any layers you'll need in the forward pass
 
         #self attention layer
-        self.self_attn = MultiHeadAttention(num_heads, embedding_dim, qk_length, value_length)
+        self.self_attn = MultiHeadAttention(
+            num_heads, embedding_dim, qk_length, value_length, num_kv_heads
+        )
 
-        self.cross_attn = MultiHeadAttention(num_heads, embedding_dim, qk_length, value_length)
+        self.cross_attn = MultiHeadAttention(
+            num_heads, embedding_dim, qk_length, value_length, num_kv_heads
+        )
 
         self.ffn = FeedForwardNN(embedding_dim, ffn_hidden_dim)
 
@@ -62,30 +77,66 @@ class DecoderLayer(nn.Module):
         #raise NotImplementedError("Need to implement DecoderLayer layers")
 
 
+    def add_and_norm(
+        self, norm: nn.LayerNorm, x: torch.Tensor, sublayer_out: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Residual add followed by LayerNorm.
+
+        sublayer_out is the fresh output of a linear layer, which autograd
+        doesn't save for backward, so the residual can be accumulated into it
+        in place instead of allocating a temporary for x + sublayer_out. Under
+        autocast the sublayer output may be lower precision than x, in which
+        case we fall back to the out-of-place add so the residual isn't
+        downcast.
+        """
+        if sublayer_out.dtype == x.dtype:
+            return norm(sublayer_out.add_(x))
+        return norm(x + sublayer_out)
+
+    def precompute_cross_kv(
+        self, enc_x: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Project the encoder output into the cross-attention keys and values.
+        These only depend on enc_x, so they can be computed once and reused
+        for every decoding step.
+        """
+        return self.cross_attn.precompute_kv(enc_x)
+
     def forward(
         self,
         x: torch.Tensor,
         enc_x: torch.Tensor | None,
-        tgt_mask: torch.Tensor,
+        tgt_mask: torch.Tensor | None,
         src_mask: torch.Tensor | None = None,
+        cross_kv: tuple[torch.Tensor, torch.Tensor] | None = None,
+        is_causal: bool = False,
+        block_mask: BlockMask | None = None,
     ) -> torch.Tensor:
         """
         The forward pass of the DecoderLayer.
+
+        If is_causal is True, self-attention is causally masked on top of
+        tgt_mask, so tgt_mask only needs to carry padding (or can be None).
+        If block_mask is given, self-attention uses it instead of tgt_mask.
         """
 
         # masked self-attention with res add and norm -> first mha block
-        attn1 = self.self_attn(x, x, x, tgt_mask)
-        x = self.norm1(x + attn1)
+        attn1 = self.self_attn(
+            x, x, x, tgt_mask, is_causal=is_causal, block_mask=block_mask
+        )
+        x = self.add_and_norm(self.norm1, x, attn1)
 
         # cross_attention, attending to encoder output, with residual + norm -> second mha block
         if enc_x is not None:
-            attn2 = self.cross_attn(x, enc_x, enc_x, src_mask)
-            x = self.norm2(x + attn2)
+            attn2 = self.cross_attn(x, enc_x, enc_x, src_mask, precomputed_kv=cross_kv)
+            x = self.add_and_norm(self.norm2, x, attn2)
 
         ffn_out = self.ffn(x)
 
         #final res + norm
-        x = self.norm3(x + ffn_out)
+        x = self.add_and_norm(self.norm3, x, ffn_out)
 
         return x
 
@@ -104,6 +155,9 @@ class Decoder(nn.Module):
         value_length: int,
         max_length: int,
         dropout: float = 0.1,
+        window_size: int | None = None,
+        tie_weights: bool = False,
+        num_kv_heads: int | None = None,
     ):
         """
         Remember that the decoder will take in a sequence
@@ -121,6 +175,21 @@ class Decoder(nn.Module):
         Additionally, for every Multi-Head Attention layer, we
         need to know how long each query/key is, and how long
         each value is.
+
+        If window_size is set, self-attention becomes causal sliding-window
+        attention: each token only attends to the window_size most recent
+        tokens (itself included). Sequences longer than the window run
+        through FlexAttention with a block-sparse mask.
+
+        If tie_weights is True, the output projection shares its weight with
+        the token embedding. As in Vaswani et al., the shared matrix is then
+        initialized with std 1 / sqrt(embedding_dim), so logits start out at
+        unit scale, and embeddings are multiplied by sqrt(embedding_dim)
+        before the positional encoding is added.
+
+        If num_kv_heads is set, every attention layer uses grouped-query
+        attention with that many K/V heads, which also shrinks the
+        precomputed cross-attention K/V cache.
         """
         super().__init__()
 
@@ -132,6 +201,7 @@ class Decoder(nn.Module):
 
         self.qk_length = qk_length
         self.value_length = value_length
+        self.window_size = window_size
 
         # Define any layers you'll need in the forward pass
         # Hint: You may find `ModuleList`s useful for creating
@@ -146,25 +216,62 @@ class Decoder(nn.Module):
         self.layers = nn.ModuleList([
             DecoderLayer(
                 num_heads, embedding_dim, ffn_hidden_dim,
-                qk_length, value_length,
+                qk_length, value_length, dropout, num_kv_heads,
             )
             for _ in range(num_layers)
         ])
         self.out = nn.Linear(embedding_dim, vocab_size)
+        if tie_weights:
+            # both are (vocab_size, embedding_dim), so the logits GEMM can reuse
+            # the embedding matrix: V * C fewer parameters to store and read
+            self.out.weight = self.token_embedding.weight
+            # nn.Embedding's N(0, 1) init would make the initial logits (from
+            # LayerNorm'd inputs) have std ~sqrt(C) and saturate the softmax
+            nn.init.normal_(self.token_embedding.weight, std=embedding_dim**-0.5)
+        self.embed_scale = embedding_dim**0.5 if tie_weights else 1.0
         #raise NotImplementedError("Need to implement Decoder layers")
 
+    def precompute_cross_kv(
+        self, enc_x: torch.Tensor
+    ) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Compute the cross-attention keys and values of every layer for the
+        given encoder output. During autoregressive decoding, compute this once
+        per source sentence and pass it to `forward` as `cross_kv`.
+        """
+        return [layer.precompute_cross_kv(enc_x) for layer in self.layers]
+
     def forward(
         self,
         x: torch.Tensor,
         enc_x: torch.Tensor | None = None,
         tgt_mask: torch.Tensor | None = None,
         src_mask: torch.Tensor | None = None,
+        cross_kv: list[tuple[torch.Tensor, torch.Tensor]] | None = None,
+        is_causal: bool = False,
+        last_token_only: bool = False,
+        output_positions: torch.Tensor | None = None,
     ) -> torch.Tensor:
         """
         The forward pass of the Decoder.
+
+        If last_token_only is True, only the final position is projected onto
+        the vocabulary and the result has shape (B, 1, vocab_size). During
+        generation that is all we sample from, and it avoids materializing
+        (B, T, vocab_size) logits, which is the largest tensor in the model.
+        output_positions generalizes this: a (B,) long tensor of per-sequence
+        positions to project, also giving (B, 1, vocab_size) logits.
+
+        Masks are boolean and True where attention is allowed (the
+        convention F.scaled_dot_product_attention uses), so they are consumed
+        as-is by every layer. Pass is_causal=True instead of baking a (T, T)
+        causal mask into tgt_mask; with no tgt_mask at all, attention never
+        materializes a mask.
         """
         x = x.long() 
         x = self.token_embedding(x)
+        if self.embed_scale != 1.0:
+            x = x * self.embed_scale
         x = self.positional_encoding(x)
 
 
@@ -178,7 +285,176 @@ class Decoder(nn.Module):
         ######mask dim not matching my scores dim fix
 
 
-        for layer in self.layers:
-            x = layer(x, enc_x, tgt_mask, src_mask)
+        # sliding-window self-attention is always causal, and only differs
+        # from plain causal attention once the sequence is longer than the window
+        seq_len = x.size(1)
+        windowed = self.window_size is not None and seq_len > self.window_size
+        block_mask = None
+        if self.window_size is not None:
+            is_causal = True
+
+        if is_causal and tgt_mask is not None:
+            # SDPA can't combine is_causal with an explicit mask, so fold the
+            # causal (or sliding-window) part into the padding mask once here
+            # instead of in every layer's attention call
+            if windowed:
+                keep = sliding_window_dense_mask(self.window_size, seq_len, x.device)
+            else:
+                keep = torch.ones(
+                    seq_len, seq_len, dtype=torch.bool, device=x.device
+                ).tril()
+            tgt_mask = tgt_mask & keep
+            is_causal = False
+        elif windowed:
+            block_mask = sliding_window_block_mask(self.window_size, seq_len, x.device)
+
+        if enc_x is not None and cross_kv is None:
+            cross_kv = self.precompute_cross_kv(enc_x)
+
+        for i, layer in enumerate(self.layers):
+            layer_kv = cross_kv[i] if cross_kv is not None else None
+            x = layer(
+                x,
+                enc_x,
+                tgt_mask,
+                src_mask,
+                cross_kv=layer_kv,
+                is_causal=is_causal,
+                block_mask=block_mask,
+            )
+
+        if output_positions is not None:
+            index = output_positions.view(-1, 1, 1).expand(-1, 1, x.size(-1))
+            x = x.gather(1, index)
+        elif last_token_only:
+            x = x[:, -1:]
         x = self.out(x)
-        return x
\ No newline at end of file
+        return x
+
+
+class CUDAGraphDecoder:
+    def __init__(
+        self,
+        decoder: Decoder,
+        batch_size: int,
+        max_length: int,
+        max_src_length: int | None = None,
+        warmup_steps: int = 3,
+    ):
+        """
+        Wraps a Decoder for autoregressive inference on CUDA by capturing one
+        fixed-shape forward pass in a CUDA graph and replaying it every step,
+        so each step costs a single graph launch instead of re-dispatching
+        every op from Python. Build it once per model and reuse it.
+
+        The target buffer always has shape (batch_size, max_length). Because
+        self-attention is causal, the hidden state at position T - 1 only
+        depends on the first T tokens, so whatever sits past the current
+        prefix is ignored. Only that position is projected onto the vocab.
+
+        If max_src_length is given, the graph also cross-attends to a static
+        (batch_size, max_src_length) encoder buffer; call `set_source` with
+        each new encoder output. Shorter sources are padded and the padding
+        is masked out, so the same graph serves every source sentence.
+        The decoder should be in eval mode.
+        """
+        device = next(decoder.parameters()).device
+
+        self.decoder = decoder
+        self.max_length = max_length
+        self.max_src_length = max_src_length
+
+        self.static_x = torch.zeros(
+            batch_size, max_length, dtype=torch.long, device=device
+        )
+        self.static_pos = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+        self.static_enc_x = None
+        self.static_src_mask = None
+        self.static_cross_kv = None
+        if max_src_length is not None:
+            self.static_enc_x = torch.zeros(
+                batch_size, max_src_length, decoder.embedding_dim, device=device
+            )
+            self.static_src_mask = torch.ones(
+                batch_size, 1, 1, max_src_length, dtype=torch.bool, device=device
+            )
+            with torch.no_grad():
+                self.static_cross_kv = decoder.precompute_cross_kv(self.static_enc_x)
+
+        def step() -> torch.Tensor:
+            return decoder(
+                self.static_x,
+                self.static_enc_x,
+                None,
+                self.static_src_mask,
+                cross_kv=self.static_cross_kv,
+                is_causal=True,
+                output_positions=self.static_pos,
+            )
+
+        # warm up on a side stream (as torch.cuda.graphs recommends) so lazy
+        # initialization like cuBLAS handles and kernel selection isn't captured.
+        # Everything runs under the model's device: torch.cuda.graph's default
+        # capture stream lives on the *current* device, so if the model sits on
+        # another GPU its kernels would never be recorded. Capturing on our own
+        # stream on `device` avoids that.
+        with torch.cuda.device(device):
+            stream = torch.cuda.Stream(device=device)
+            stream.wait_stream(torch.cuda.current_stream(device))
+            with torch.cuda.stream(stream), torch.no_grad():
+                for _ in range(warmup_steps):
+                    step()
+            torch.cuda.current_stream(device).wait_stream(stream)
+
+            self.graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.graph, stream=stream), torch.no_grad():
+                self.static_out = step()
+
+    def set_source(self, enc_x: torch.Tensor, src_mask: torch.Tensor | None = None):
+        """
+        Load a new encoder output of shape (batch_size, T_src, C), with
+        T_src <= max_src_length, and its (batch_size, 1, 1, T_src) pad mask
+        (True = may attend) into the static buffers. The cross-attention K/V
+        are projected here, outside the graph, once per source.
+        """
+        assert self.max_src_length is not None, (
+            "set_source needs a graph built with max_src_length"
+        )
+        T_src = enc_x.size(1)
+        assert T_src <= self.max_src_length, "Source longer than max_src_length"
+
+        with torch.no_grad():
+            cross_kv = self.decoder.precompute_cross_kv(enc_x)
+
+        self.static_enc_x.zero_()
+        self.static_enc_x[:, :T_src].copy_(enc_x)
+
+        # everything past the real source is padding and must not be attended
+        self.static_src_mask.zero_()
+        if src_mask is None:
+            self.static_src_mask[..., :T_src] = True
+        else:
+            self.static_src_mask[..., :T_src].copy_(src_mask)
+
+        for (static_K, static_V), (K, V) in zip(self.static_cross_kv, cross_kv):
+            static_K.zero_()
+            static_V.zero_()
+            static_K[:, :, :T_src].copy_(K)
+            static_V[:, :, :T_src].copy_(V)
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Run the captured forward on the token prefix x of shape (B, T), with
+        T <= max_length, and return the logits for its last position, of
+        shape (B, 1, vocab_size).
+
+        The result is the graph's static output buffer and is overwritten by
+        the next call; clone it if you need to keep it.
+        """
+        T = x.size(1)
+        assert T <= self.max_length, "Prefix longer than max_length"
+        self.static_x[:, :T].copy_(x)
+        self.static_pos.fill_(T - 1)
+        self.graph.replay()
+        return self.static_out
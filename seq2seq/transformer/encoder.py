@@ -43,10 +43,11 @@ class PositionalEncoding(nn.Module):
         Arguments:
             x: Tensor, shape (B, T, C)
         """
-        x = x.transpose(0, 1)
-        x = x + self.pe[: x.size(0)]
-        x = self.dropout(x)
-        return x.transpose(0, 1)
+        # pe is (max_len, 1, C); taking [:T, 0] gives a (T, C) view that
+        # broadcasts over the batch, so the add reads the embeddings once and
+        # writes a contiguous (B, T, C) result without transposing around it
+        x = x + self.pe[: x.size(1), 0]
+        return self.dropout(x)
 
 
 class EncoderLayer(nn.Module):
@@ -19,7 +19,12 @@ class Transformer(nn.Module):
         value_length: int,
         dropout: float = 0.1,
         device: str = "cpu",
+        tie_weights: bool = False,
     ):
+        """
+        If tie_weights is True, the decoder's output projection shares its
+        weight with the decoder's token embedding (see Decoder).
+        """
         super().__init__()
 
         self.pad_idx = pad_idx
@@ -55,16 +60,20 @@ class Transformer(nn.Module):
             value_length,
             max_length,
             dropout,
+            tie_weights=tie_weights,
         )
 
+    # Masks are True where attention is allowed, which is what
+    # F.scaled_dot_product_attention consumes directly, so they are built
+    # once here and never flipped inside the attention layers.
     def make_pad_mask(self, q: torch.Tensor, k: torch.Tensor):
-        pad_mask = k.eq(self.pad_idx).unsqueeze(1).unsqueeze(1)
+        pad_mask = k.ne(self.pad_idx).unsqueeze(1).unsqueeze(1)
         return pad_mask
 
     def make_causal_mask(self, q: torch.Tensor, k: torch.Tensor):
         len_q, len_k = q.size(1), k.size(1)
-        mask = torch.triu(
-            torch.ones(len_q, len_k, device=self.device, dtype=torch.bool), diagonal=1
+        mask = torch.tril(
+            torch.ones(len_q, len_k, device=self.device, dtype=torch.bool)
         )
         return mask
 
@@ -72,11 +81,10 @@ class Transformer(nn.Module):
         src_mask = self.make_pad_mask(src, src)
         src_tgt_mask = self.make_pad_mask(tgt, src)
 
+        # causality is applied inside attention via is_causal, so only the
+        # padding part of the target mask is built here
         tgt_pad_mask = self.make_pad_mask(tgt, tgt)
-        tgt_causal_mask = self.make_causal_mask(tgt, tgt)
-
-        tgt_mask = tgt_pad_mask | tgt_causal_mask
 
         enc_src = self.encoder(src, src_mask)
-        output = self.decoder(tgt, enc_src, tgt_mask, src_tgt_mask)
+        output = self.decoder(tgt, enc_src, tgt_pad_mask, src_tgt_mask, is_causal=True)
         return output
@@ -39,6 +39,23 @@ class TestCharacterTokenizer(unittest.TestCase):
         decoded = tokenizer.decode(encoded)
         self.assertEqual(decoded, text.lower())
 
+    def test_encode_batch(self):
+        """Test batch encoding pads to the longest string."""
+        tokenizer = CharacterTokenizer()
+        texts = ["hello", "", "Bonjour le monde"]
+        ids, lengths = tokenizer.encode_batch(texts, pad_id=0)
+
+        self.assertEqual(ids.size(), (3, 16))
+        self.assertEqual(lengths.tolist(), [5, 0, 16])
+        for text, row, length in zip(texts, ids, lengths):
+            self.assertEqual(tokenizer.decode(row[:length]), text.lower())
+
+    def test_unknown_character(self):
+        """Test that characters outside the vocab raise."""
+        tokenizer = CharacterTokenizer()
+        with self.assertRaises(ValueError):
+            tokenizer.encode("hello \U0001F600")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -65,3 +65,141 @@ class TestMultiHeadAttention(unittest.TestCase):
         Q, K, V = x, x, x
 
         self.assertEqual(mha(Q, K, V).size(), (32, 64, 32))
+
+    def test_forward_cross_attention(self):
+        """Sanity test for cross-attention, where K and V differ from Q."""
+        torch.manual_seed(42)
+        mha = MultiHeadAttention(
+            embedding_dim=32, num_heads=8, qk_length=32, value_length=16
+        )
+
+        # (B, T, C) for the decoder, (B, T_enc, C) for the encoder
+        x = torch.randn(32, 64, 32)
+        enc_x = torch.randn(32, 48, 32)
+
+        self.assertEqual(mha(x, enc_x, enc_x).size(), (32, 64, 32))
+
+    def test_forward_fused_projection_paths(self):
+        """The fused Q/K/V and K/V projections should match the general path."""
+        torch.manual_seed(42)
+        mha = MultiHeadAttention(
+            embedding_dim=32, num_heads=8, qk_length=16, value_length=8
+        )
+
+        x = torch.randn(4, 16, 32)
+        enc_x = torch.randn(4, 24, 32)
+
+        # Q is K is V -> fused self-attention, vs. three separate projections
+        self.assertTrue(
+            torch.allclose(mha(x, x, x), mha(x, x.clone(), x.clone()), atol=1e-6)
+        )
+        # K is V -> fused cross-attention K/V, vs. separate K and V projections
+        self.assertTrue(
+            torch.allclose(
+                mha(x, enc_x, enc_x), mha(x, enc_x, enc_x.clone()), atol=1e-6
+            )
+        )
+
+    def test_load_legacy_state_dict(self):
+        """Checkpoints with separate Q, K and V layers should load into in_proj."""
+        torch.manual_seed(42)
+        Q = torch.nn.Linear(32, 8 * 16)
+        K = torch.nn.Linear(32, 8 * 16)
+        V = torch.nn.Linear(32, 8 * 8)
+        output_projection = torch.nn.Linear(8 * 8, 32)
+
+        legacy_state_dict = {}
+        for name, layer in [
+            ("Q", Q), ("K", K), ("V", V), ("output_projection", output_projection)
+        ]:
+            for key, value in layer.state_dict().items():
+                legacy_state_dict[f"{name}.{key}"] = value
+
+        mha = MultiHeadAttention(
+            embedding_dim=32, num_heads=8, qk_length=16, value_length=8
+        )
+        mha.load_state_dict(legacy_state_dict)  # strict
+
+        x = torch.randn(4, 16, 32)
+        with torch.no_grad():
+            expected = output_projection(
+                mha.combine_heads(
+                    mha.scaled_dot_product_attention(
+                        mha.split_heads(Q(x), 16),
+                        mha.split_heads(K(x), 16),
+                        mha.split_heads(V(x), 8),
+                    )
+                )
+            )
+            actual = mha(x, x, x)
+
+        self.assertTrue(torch.allclose(expected, actual, atol=1e-6))
+
+    def test_scaled_dot_product_attention_is_causal(self):
+        """is_causal should match passing an explicit causal mask."""
+        torch.manual_seed(42)
+        mha = MultiHeadAttention(
+            embedding_dim=32, num_heads=8, qk_length=32, value_length=32
+        )
+        Q = torch.randn(4, 8, 16, 32)
+        K = torch.randn(4, 8, 16, 32)
+        V = torch.randn(4, 8, 16, 32)
+        causal_mask = torch.ones(16, 16, dtype=torch.bool).tril()
+        pad_mask = torch.ones(4, 1, 1, 16, dtype=torch.bool)
+        pad_mask[:, :, :, 12:] = False
+
+        expected = mha.scaled_dot_product_attention(Q, K, V, causal_mask)
+        self.assertTrue(
+            torch.allclose(
+                mha.scaled_dot_product_attention(Q, K, V, is_causal=True),
+                expected,
+                atol=1e-6,
+            )
+        )
+
+        expected = mha.scaled_dot_product_attention(Q, K, V, pad_mask & causal_mask)
+        self.assertTrue(
+            torch.allclose(
+                mha.scaled_dot_product_attention(Q, K, V, pad_mask, is_causal=True),
+                expected,
+                atol=1e-6,
+            )
+        )
+
+    def test_forward_grouped_query_attention(self):
+        """Sanity test for the forward pass with fewer K/V heads than Q heads."""
+        torch.manual_seed(42)
+        mha = MultiHeadAttention(
+            embedding_dim=32, num_heads=8, qk_length=32, value_length=32, num_kv_heads=2
+        )
+
+        x = torch.randn(32, 64, 32)
+        enc_x = torch.randn(32, 48, 32)
+        K_split, V_split = mha.precompute_kv(enc_x)
+
+        self.assertEqual(mha(x, x, x).size(), (32, 64, 32))
+        self.assertEqual(mha(x, enc_x, enc_x).size(), (32, 64, 32))
+        self.assertEqual(K_split.size(), (32, 2, 48, 32))
+        self.assertEqual(V_split.size(), (32, 2, 48, 32))
+
+    def test_scaled_dot_product_attention_grouped_query(self):
+        """Each K/V head should serve a contiguous group of num_heads // num_kv_heads query heads."""
+        torch.manual_seed(42)
+        gqa = MultiHeadAttention(
+            embedding_dim=32, num_heads=8, qk_length=32, value_length=32, num_kv_heads=2
+        )
+        mha = MultiHeadAttention(
+            embedding_dim=32, num_heads=8, qk_length=32, value_length=32
+        )
+        Q = torch.randn(4, 8, 16, 32)
+        K = torch.randn(4, 2, 16, 32)
+        V = torch.randn(4, 2, 16, 32)
+
+        expected = mha.scaled_dot_product_attention(
+            Q, K.repeat_interleave(4, dim=1), V.repeat_interleave(4, dim=1)
+        )
+        self.assertTrue(
+            torch.allclose(
+                gqa.scaled_dot_product_attention(Q, K, V), expected, atol=1e-6
+            )
+        )
@@ -1,9 +1,22 @@
-from seq2seq.transformer import DecoderLayer, Decoder
+from seq2seq.transformer import DecoderLayer, Decoder, CUDAGraphDecoder
 
 import torch
+import torch._dynamo.exc
+import torch._inductor.exc
 
 import unittest
 
+# errors raised when torch.compile has no working backend to lower
+# FlexAttention with (InductorError only exists in newer torch releases)
+BACKEND_UNAVAILABLE_ERRORS = tuple(
+    error
+    for error in (
+        getattr(torch._dynamo.exc, "BackendCompilerFailed", None),
+        getattr(torch._inductor.exc, "InductorError", None),
+    )
+    if error is not None
+)
+
 
 class TestDecoder(unittest.TestCase):
     def test_decoder_layer(self):
@@ -42,3 +55,176 @@ class TestDecoder(unittest.TestCase):
         enc_x = torch.randn(32, 64, 32)
 
         self.assertEqual(decoder(tgt, enc_x).size(), (32, 64, 100))
+
+    def test_decoder_precomputed_cross_kv(self):
+        """Precomputed cross-attention K/V should match computing them inline."""
+        torch.manual_seed(42)
+        decoder = Decoder(
+            vocab_size=100,
+            num_layers=2,
+            num_heads=8,
+            embedding_dim=32,
+            ffn_hidden_dim=64,
+            qk_length=32,
+            value_length=32,
+            max_length=500,
+            dropout=0.1,
+        ).eval()
+        tgt = torch.randint(0, 100, (4, 16))
+        enc_x = torch.randn(4, 24, 32)
+
+        with torch.no_grad():
+            cross_kv = decoder.precompute_cross_kv(enc_x)
+            expected = decoder(tgt, enc_x)
+            actual = decoder(tgt, enc_x, cross_kv=cross_kv)
+
+        self.assertTrue(torch.allclose(expected, actual))
+
+    def test_decoder_sliding_window_with_mask(self):
+        """Sliding-window decoder with an explicit padding mask."""
+        torch.manual_seed(42)
+        decoder = Decoder(
+            vocab_size=100,
+            num_layers=2,
+            num_heads=8,
+            embedding_dim=32,
+            ffn_hidden_dim=64,
+            qk_length=32,
+            value_length=32,
+            max_length=500,
+            dropout=0.1,
+            window_size=8,
+        )
+        tgt = torch.randint(0, 100, (4, 32))
+        tgt_mask = torch.ones(4, 1, 1, 32, dtype=torch.bool)
+
+        self.assertEqual(decoder(tgt, tgt_mask=tgt_mask).size(), (4, 32, 100))
+
+    def test_decoder_sliding_window_flex_attention(self):
+        """
+        With T > window_size and no tgt_mask, the decoder runs FlexAttention
+        with a block mask; it should match the dense SDPA fallback, which is
+        taken when a (here all-True) tgt_mask is passed in.
+        """
+        torch.manual_seed(42)
+        decoder = Decoder(
+            vocab_size=100,
+            num_layers=2,
+            num_heads=8,
+            embedding_dim=32,
+            ffn_hidden_dim=64,
+            qk_length=32,
+            value_length=32,
+            max_length=500,
+            dropout=0.1,
+            window_size=8,
+        ).eval()
+        tgt = torch.randint(0, 100, (4, 32))
+        tgt_mask = torch.ones(4, 1, 1, 32, dtype=torch.bool)
+
+        with torch.no_grad():
+            expected = decoder(tgt, tgt_mask=tgt_mask)
+            try:
+                actual = decoder(tgt)
+            except BACKEND_UNAVAILABLE_ERRORS as e:
+                # compiled FlexAttention needs a backend (Triton on CUDA, a C++
+                # toolchain on CPU) that may not be available here; anything
+                # else is a real bug in the FlexAttention path and should fail
+                self.skipTest(f"FlexAttention is not supported on this device: {e}")
+
+        self.assertTrue(torch.allclose(expected, actual, atol=1e-5))
+
+    def test_decoder_tied_weights(self):
+        """The output projection should share the token embedding weight."""
+        torch.manual_seed(42)
+        decoder = Decoder(
+            vocab_size=100,
+            num_layers=2,
+            num_heads=8,
+            embedding_dim=256,
+            ffn_hidden_dim=64,
+            qk_length=32,
+            value_length=32,
+            max_length=500,
+            dropout=0.1,
+            tie_weights=True,
+        ).eval()
+        tgt = torch.randint(0, 100, (4, 16))
+
+        self.assertIs(decoder.out.weight, decoder.token_embedding.weight)
+
+        # initial logits should be O(1), not O(sqrt(embedding_dim)) = 16
+        with torch.no_grad():
+            logits = decoder(tgt, is_causal=True)
+        self.assertLess(logits.std().item(), 2.0)
+
+    def test_decoder_last_token_only(self):
+        """last_token_only should return the logits of the final position."""
+        torch.manual_seed(42)
+        decoder = Decoder(
+            vocab_size=100,
+            num_layers=2,
+            num_heads=8,
+            embedding_dim=32,
+            ffn_hidden_dim=64,
+            qk_length=32,
+            value_length=32,
+            max_length=500,
+            dropout=0.1,
+        ).eval()
+        tgt = torch.randint(0, 100, (4, 16))
+
+        with torch.no_grad():
+            expected = decoder(tgt, is_causal=True)[:, -1:]
+            actual = decoder(tgt, is_causal=True, last_token_only=True)
+
+        self.assertEqual(actual.size(), (4, 1, 100))
+        self.assertTrue(torch.allclose(expected, actual, atol=1e-6))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA graphs need a GPU")
+    def test_cuda_graph_decoder(self):
+        """One captured graph should match the eager decoder across sources and prefixes."""
+        # use the last GPU so that, on multi-GPU machines, the graph is built
+        # on a device other than the current (default) one
+        device = torch.device("cuda", torch.cuda.device_count() - 1)
+
+        torch.manual_seed(42)
+        decoder = Decoder(
+            vocab_size=100,
+            num_layers=2,
+            num_heads=8,
+            embedding_dim=32,
+            ffn_hidden_dim=64,
+            qk_length=32,
+            value_length=32,
+            max_length=500,
+            dropout=0.1,
+        ).to(device).eval()
+        graphed = CUDAGraphDecoder(decoder, 2, 24, max_src_length=20)
+
+        previous = None
+        for T_src in [20, 7]:
+            enc_x = torch.randn(2, T_src, 32, device=device)
+            src_mask = torch.ones(2, 1, 1, T_src, dtype=torch.bool, device=device)
+            src_mask[1, ..., T_src - 2 :] = False
+            graphed.set_source(enc_x, src_mask)
+
+            for T in [1, 5, 24]:
+                tgt = torch.randint(0, 100, (2, T), device=device)
+                with torch.no_grad():
+                    expected = decoder(
+                        tgt, enc_x, None, src_mask, is_causal=True, last_token_only=True
+                    )
+                actual = graphed(tgt)
+
+                self.assertEqual(actual.device, device)
+                self.assertEqual(actual.size(), (2, 1, 100))
+                self.assertTrue(torch.allclose(expected, actual, atol=1e-4))
+
+                # an empty graph would leave stale logits in static_out
+                if previous is not None:
+                    self.assertFalse(torch.equal(previous, actual))
+                previous = actual.clone()
+
+        with self.assertRaises(AssertionError):
+            graphed(torch.zeros(2, 25, dtype=torch.long, device=device))
@@ -25,3 +25,21 @@ class TestTransformer(unittest.TestCase):
         tgt = torch.randint(0, 100, (32, 64))
 
         self.assertEqual(transformer(src, tgt).size(), (32, 64, 100))
+
+    def test_transformer_tied_weights(self):
+        """tie_weights should reach the decoder."""
+        transformer = Transformer(
+            pad_idx=0,
+            vocab_size=100,
+            num_layers=2,
+            num_heads=8,
+            embedding_dim=32,
+            ffn_hidden_dim=64,
+            qk_length=32,
+            value_length=32,
+            max_length=500,
+            tie_weights=True,
+        )
+        self.assertIs(
+            transformer.decoder.out.weight, transformer.decoder.token_embedding.weight
+        )